@@ -7,20 +7,26 @@ Fetches ALL devices from Tuya Cloud API and publishes to MQTT
 import os
 import sys
 import time
-import json
+import logging
+import threading
+import types
 import tinytuya
 import paho.mqtt.client as mqtt
 from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
 
 # Handle library installation
 try:
     import pymongo
     import certifi
+    import orjson
 except ImportError:
-    print("Installing dependencies (pymongo, certifi)...")
-    os.system("pip install pymongo certifi")    
+    print("Installing dependencies (pymongo, certifi, orjson)...")
+    os.system("pip install pymongo certifi orjson")    
     import pymongo
     import certifi
+    import orjson
 
 # ===== Configuration =====
 # Tuya Cloud API
@@ -41,6 +47,67 @@ COLLECTION_NAME = os.getenv("MONGO_COLLECTION", "device_raw_data")
 # Polling interval (seconds)
 POLL_INTERVAL = 2
 
+# Logging (set LOG_LEVEL=DEBUG to print every status item)
+LOG_LEVEL = (os.getenv("LOG_LEVEL") or "INFO").upper()
+logging.basicConfig(format="%(message)s", stream=sys.stdout)  # Same stream as print()
+log = logging.getLogger("tuya")
+if isinstance(logging.getLevelName(LOG_LEVEL), int):
+    log.setLevel(LOG_LEVEL)
+else:
+    log.setLevel(logging.INFO)
+    log.warning("Unknown LOG_LEVEL %r, using INFO", LOG_LEVEL)
+
+# Unchanged states are skipped, but everything is republished this often (seconds)
+STATE_REPUBLISH_INTERVAL = 60
+
+# Max device IDs per batch status request (Tuya API limit)
+BATCH_STATUS_SIZE = 20
+
+# Tuya error code for "permission deny" (endpoint not authorized for the project)
+TUYA_PERMISSION_DENIED = 1106
+
+# Lookup tables below are read-only; keys are interned to match the
+# interned status codes in poll_device()
+def _frozen(mapping):
+    return types.MappingProxyType({sys.intern(k): v for k, v in mapping.items()})
+
+# Raw Tuya values are scaled by dividing by these factors
+SCALE_FACTORS = _frozen({
+    "cur_voltage": 10.0,   # 0.1 V
+    "cur_power": 10.0,     # 0.1 W
+    "add_ele": 1000.0,     # Wh -> kWh
+})
+
+# Fast-changing metering codes: published without retain, since a stale
+# last value is useless to a new subscriber (switch states stay retained).
+# Any retained value left from older versions is cleared once per topic.
+UNRETAINED_CODES = frozenset(map(sys.intern, ("cur_current", "cur_power", "cur_voltage", "add_ele")))
+
+# Command payloads that map to boolean switch values
+ONOFF_PAYLOADS = frozenset(("ON", "OFF"))
+
+# Thai Translation Map
+THAI_LABELS = _frozen({
+    "cur_current": "กระแสไฟฟ้า (mA)",
+    "cur_power": "กำลังไฟฟ้า (W)",
+    "cur_voltage": "แรงดันไฟฟ้า (V)",
+    "add_ele": "พลังงานสะสม (kWh)", # Unit updated to kWh
+    "switch": "สถานะสวิตช์",
+    "switch_1": "สวิตช์ 1",
+    "switch_2": "สวิตช์ 2",
+    "countdown_1": "นับถอยหลัง 1",
+    "countdown_2": "นับถอยหลัง 2",
+    "relay_status": "สถานะ Relay",
+    "test_bit": "โหมดทดสอบ",
+    "voltage_coe": "ค่าแก้แรงดัน",
+    "electric_coe": "ค่าแก้พลังงาน",
+    "power_coe": "ค่าแก้กำลังไฟ",
+    "electricity_coe": "ค่าแก้หน่วยไฟฟ้า",
+    "fault": "ความผิดปกติ",
+    "switch_backlight": "ไฟพื้นหลัง",
+    "switch_inching": "Inch Mode"
+})
+
 print("="*60)
 print("Tuya Cloud → MQTT Bridge (ALL DEVICES)")
 print("="*60)
@@ -95,13 +162,61 @@ if device_count == 0:
     print("Make sure you've linked your Tuya App account in IoT Platform")
     sys.exit(1)
 
+# ===== Precompute Per-Device Topics & Discovery =====
+# Topics and discovery payloads are static per device, so build them once
+device_ctx = []
+for device in devices:
+    device_id = device.get('id')
+    if not device_id:
+        continue
+    device_name = device.get('name', 'Unknown')
+    topic_prefix = MQTT_TOPIC_PREFIX + "/" + device_id + "/"
+    telemetry_topic = topic_prefix + "telemetry"
+    device_ctx.append({
+        "id": device_id,
+        "name": device_name,
+        "topic_prefix": topic_prefix,  # tuya/{device_id}/
+        "telemetry_topic": telemetry_topic,
+        "response_topic": topic_prefix + "response",
+        # Static head of the telemetry JSON: {"name":...,"id":...,"data":
+        "telemetry_head": orjson.dumps({"name": device_name, "id": device_id})[:-1] + b',"data":',
+        "discovery_topic": f"discovery/device/{device_id}/config",
+        "discovery_payload": orjson.dumps({
+            "name": device_name,
+            "unique_id": device_id,
+            "state_topic": telemetry_topic,
+            "command_topic": topic_prefix + "set",  # Base command topic
+            "device": {
+                "identifiers": [device_id],
+                "name": device_name,
+                "manufacturer": "Tuya"
+            }
+        }),
+        "state_topic_for": {},  # code -> tuya/{device_id}/{code}/state, filled lazily
+        "last_state": {},  # code -> last published state payload
+        "state_refreshed_at": 0.0,  # monotonic time of the last full republish
+    })
+device_ctx_by_id = {ctx["id"]: ctx for ctx in device_ctx}
+
+# Retained discovery burst, sent as-is on every (re)connect
+discovery_msgs = [(ctx["discovery_topic"], ctx["discovery_payload"]) for ctx in device_ctx]
+
 # ===== Initialize MongoDB =====
 try:
     if MONGO_URI:
         print("\n1. Connecting to MongoDB Atlas...")
-        mongo_client = pymongo.MongoClient(MONGO_URI, tlsCAFile=certifi.where())
+        mongo_client = pymongo.MongoClient(
+            MONGO_URI,
+            tlsCAFile=certifi.where(),
+            heartbeatFrequencyMS=30000,     # Default 10s; one writer doesn't need faster checks
+            serverSelectionTimeoutMS=5000,  # Fail a cycle's insert fast instead of hanging 30s
+            compressors="zlib"              # stdlib-backed, no extra package needed
+        )
         db = mongo_client[DB_NAME]
-        collection = db[COLLECTION_NAME]
+        # Unacknowledged writes: telemetry logging shouldn't wait on Atlas
+        collection = db[COLLECTION_NAME].with_options(
+            write_concern=pymongo.WriteConcern(w=0)
+        )
         # Test connection
         mongo_client.admin.command('ping')
         print("   Connected to MongoDB Atlas")
@@ -122,6 +237,25 @@ except ImportError:
 
 device_commands = {}  # Store device IDs by topic
 
+def publish_discovery(client):
+    """Publish retained discovery messages (for Device Manager)"""
+    # Runs on the network thread from on_connect: messages are queued on the
+    # existing connection and flushed together once the callback returns
+    for topic, payload in discovery_msgs:
+        client.publish(topic, payload, qos=0, retain=True)
+
+def forget_state(device_id, code):
+    """Drop a cached state so the next poll republishes the real value"""
+    ctx = device_ctx_by_id.get(device_id)
+    if ctx is not None:
+        ctx["last_state"].pop(code, None)
+
+def publish_response(device_id, status, msg, **fields):
+    """Publish a command result to tuya/{device_id}/response"""
+    ctx = device_ctx_by_id.get(device_id)
+    topic = ctx["response_topic"] if ctx else f"{MQTT_TOPIC_PREFIX}/{device_id}/response"
+    mqtt_client.publish(topic, orjson.dumps({"status": status, "msg": msg, **fields}), qos=0, retain=False)
+
 def on_connect(client, userdata, flags, rc, properties=None):
     if rc == 0:
         print(f"\nConnected to MQTT Broker: {MQTT_BROKER}:{MQTT_PORT}")
@@ -130,6 +264,14 @@ def on_connect(client, userdata, flags, rc, properties=None):
         client.subscribe(f"{MQTT_TOPIC_PREFIX}/+/+/set")
         client.subscribe(f"{MQTT_TOPIC_PREFIX}/+/set")  # New: Base set topic
         print(f"Subscribed to: {MQTT_TOPIC_PREFIX}/+/+/set AND {MQTT_TOPIC_PREFIX}/+/set")
+        
+        # Discovery is static and retained by the broker, so only (re)send it on connect
+        publish_discovery(client)
+        print(f"Published discovery for {len(discovery_msgs)} devices")
+        
+        # Broker may have lost state: republish everything on the next poll
+        for ctx in device_ctx:
+            ctx["state_refreshed_at"] = 0.0
     else:
         print(f"MQTT Connection failed with code {rc}")
 
@@ -138,10 +280,10 @@ def on_message(client, userdata, msg):
     topic = msg.topic
     payload = msg.payload.decode()
     
-    print(f"DEBUG: Message received topic={topic}")
-    print(f"DEBUG: Message payload={payload}")
+    log.debug("Message received topic=%s", topic)
+    log.debug("Message payload=%s", payload)
     
-    print(f"\n Command received: {topic} = {payload}")
+    log.info("\n Command received: %s = %s", topic, payload)
     
     try:
         # Format: tuya/{device_id}/{code}/set OR tuya/{device_id}/set (JSON)
@@ -151,59 +293,55 @@ def on_message(client, userdata, msg):
         if len(parts) >= 4:
             device_id = parts[1]
             code = parts[2]
+            p_up = payload.upper()
             
             commands = {
                 'commands': [{
                     'code': code,
-                    'value': payload.upper() == "ON" if payload.upper() in ["ON", "OFF"] else payload
+                    'value': p_up == "ON" if p_up in ONOFF_PAYLOADS else payload
                 }]
             }
             
             result = cloud.sendcommand(device_id, commands)
             
-            # Prepare response payload
-            resp_topic = f"{MQTT_TOPIC_PREFIX}/{device_id}/response"
-            
             if result.get('success'):
                 msg = f"Command sent: {device_id}/{code} = {payload}"
-                print(msg)
-                mqtt_client.publish(resp_topic, json.dumps({"status": "success", "msg": msg, "code": code, "value": payload}))
+                log.info(msg)
+                publish_response(device_id, "success", msg, code=code, value=payload)
                 
                 # ✨ Optimistic Update: Update UI immediately
-                state_val = "ON" if payload.upper() == "ON" else "OFF"
+                state_val = "ON" if p_up == "ON" else "OFF"
                 mqtt_client.publish(f"{MQTT_TOPIC_PREFIX}/{device_id}/{code}/state", state_val, retain=True)
+                forget_state(device_id, code)
             else:
                 msg = f"Command failed: {result}"
-                print(msg)
-                mqtt_client.publish(resp_topic, json.dumps({"status": "error", "msg": msg, "result": result}))
+                log.info(msg)
+                publish_response(device_id, "error", msg, result=result)
 
         # CASE 2: Base Topic (JSON) -> tuya/{device_id}/set
         elif len(parts) == 3 and parts[2] == 'set':
             device_id = parts[1]
             try:
                 # Try parsing JSON payload
-                import json
-                data = json.loads(payload)
+                data = orjson.loads(payload)
                 
                 command_list = []
                 for k, v in data.items():
                     if k.startswith('switch') or k.startswith('countdown'):
                         val = v
-                        if str(v).upper() == "ON": val = True
-                        if str(v).upper() == "OFF": val = False
+                        vu = str(v).upper()
+                        if vu == "ON": val = True
+                        elif vu == "OFF": val = False
                         command_list.append({'code': k, 'value': val})
                 
                 if command_list:
                     commands = {'commands': command_list}
                     result = cloud.sendcommand(device_id, commands)
                     
-                    # Prepare response payload
-                    resp_topic = f"{MQTT_TOPIC_PREFIX}/{device_id}/response"
-                    
                     if result.get('success'):
                         msg = f"JSON Command sent: {command_list}"
-                        print(msg)
-                        mqtt_client.publish(resp_topic, json.dumps({"status": "success", "msg": msg, "cmd": command_list}))
+                        log.info(msg)
+                        publish_response(device_id, "success", msg, cmd=command_list)
                         
                         # ✨ Optimistic Update: Update UI immediately for all commands in batch
                         for cmd in command_list:
@@ -211,19 +349,20 @@ def on_message(client, userdata, msg):
                              c_val = cmd['value']
                              state_val = "ON" if c_val is True else "OFF" if c_val is False else str(c_val)
                              mqtt_client.publish(f"{MQTT_TOPIC_PREFIX}/{device_id}/{c_code}/state", state_val, retain=True)
+                             forget_state(device_id, c_code)
 
                     else:
                         msg = f"JSON Command failed: {result}"
-                        print(msg)
-                        mqtt_client.publish(resp_topic, json.dumps({"status": "error", "msg": msg, "result": result}))
+                        log.info(msg)
+                        publish_response(device_id, "error", msg, result=result)
                 else:
-                    print(f"No valid commands found in JSON: {payload}")
+                    log.warning("No valid commands found in JSON: %s", payload)
                     
-            except json.JSONDecodeError:
-                print(f"Failed to parse JSON command: {payload}")
+            except orjson.JSONDecodeError:
+                log.warning("Failed to parse JSON command: %s", payload)
 
     except Exception as e:
-        print(f"Error handling command: {e}")
+        log.error("Error handling command: %s", e)
 
 mqtt_client.on_connect = on_connect
 mqtt_client.on_message = on_message
@@ -237,162 +376,223 @@ except Exception as e:
 
 # ===== Global State Tracker =====
 din_rail_is_on = True # Default to True (ON) so we log until proven OFF
+din_rail_lock = threading.Lock()
 
-# ===== Main Loop: Fetch ALL Devices → Publish to MQTT =====
-print("\n Starting data polling loop...")
-print("Press Ctrl+C to stop\n")
+DIN_RAIL_NAME = "Din Rail Wi-Fi Switch with metering"
+TOUCH_SWITCH_NAME = "WiFi Smart 2CH Touch Switch"
 
-try:
-    while True:
+# Use the batch status endpoint unless it is not authorized for this project
+use_batch_status = True
+
+def fetch_batch_status():
+    """Fetch status for all devices via the batch status endpoint.
+
+    Returns {device_id: data} shaped like cloud.getstatus() responses, or
+    None if the request failed. A permission-denied reply disables batching
+    for good; any other failure only affects the current cycle.
+    """
+    global use_batch_status
+
+    statuses = {}
+    for i in range(0, len(device_ctx), BATCH_STATUS_SIZE):
+        device_ids = ",".join(ctx["id"] for ctx in device_ctx[i:i + BATCH_STATUS_SIZE])
         try:
-            for device in devices:
-                device_id = device.get('id')
-                device_name = device.get('name', 'Unknown')
-                
-                if not device_id:
-                    continue
-                
-                # Fetch device status from Tuya Cloud
-                data = cloud.getstatus(device_id)
-                
-                if isinstance(data, dict) and 'result' in data:
-                    status_list = data['result']
+            resp = cloud.cloudrequest('/v1.0/iot-03/devices/status', query={'device_ids': device_ids})
+        except Exception as e:
+            log.warning("Batch status failed, polling per device this cycle: %s", e)
+            return None
+        if not isinstance(resp, dict) or not resp.get('success'):
+            if isinstance(resp, dict) and resp.get('code') == TUYA_PERMISSION_DENIED:
+                use_batch_status = False
+                log.warning("Batch status not authorized, switching to per-device polling: %s", resp)
+            else:
+                log.warning("Batch status failed, polling per device this cycle: %s", resp)
+            return None
+        for entry in resp.get('result', []):
+            statuses[entry.get('id')] = {'result': entry.get('status', []), 't': resp.get('t', 0)}
+    return statuses
+
+def poll_device(ctx, data, cycle_ts, cycle_dt):
+    """Publish one device's status to MQTT.
+
+    data is the device's status response; if None it is fetched with
+    cloud.getstatus(). cycle_ts/cycle_dt are the poll cycle's epoch and
+    datetime timestamps. Returns the MongoDB document to log, or None.
+    """
+    global din_rail_is_on
+
+    device_id = ctx["id"]
+    device_name = ctx["name"]
+    state_topic_for = ctx["state_topic_for"]
+    last_state = ctx["last_state"]
+    
+    doc = None
+    # Output is buffered per device so concurrent polls don't interleave
+    lines = []
+    debug = log.isEnabledFor(logging.DEBUG)
+    try:
+        # Fetch device status from Tuya Cloud (if not already batched)
+        if data is None:
+            data = cloud.getstatus(device_id)
+        
+        if isinstance(data, dict) and 'result' in data:
+            status_list = data['result']
+            
+            # Separator per device
+            current_time_str = time.strftime('%H:%M:%S')
+            lines.append(f"\n{'='*50}")
+            lines.append(f"📦 Device: {device_name} (Updated: {current_time_str})")
+            lines.append(f"{'-'*50}")
+            
+            # Parse and publish each status (only changes, unless a refresh is due)
+            device_data = {}
+            now = time.monotonic()
+            refresh = now - ctx["state_refreshed_at"] >= STATE_REPUBLISH_INTERVAL
+            if refresh:
+                ctx["state_refreshed_at"] = now
+            
+            for item in status_list:
+                if isinstance(item, dict) and 'code' in item:
+                    code = sys.intern(item['code'])
+                    value = item['value']
+                    # Scaling Logic
+                    scale = SCALE_FACTORS.get(code)
+                    if scale is not None:
+                        value = value / scale
                     
-                    # Separator per device
-                    current_time_str = time.strftime('%H:%M:%S')
-                    print(f"\n{'='*50}")
-                    print(f"📦 Device: {device_name} (Updated: {current_time_str})")
-                    print(f"{'-'*50}")
+                    device_data[code] = value
                     
-                    # Parse and publish each status
-                    device_data = {}
+                    # Publish to MQTT: tuya/{device_id}/{code}/state
+                    topic = state_topic_for.get(code)
+                    if topic is None:
+                        topic = state_topic_for[code] = ctx["topic_prefix"] + code + "/state"
+                        if code in UNRETAINED_CODES:
+                            # Empty retained payload deletes a stale retained reading
+                            mqtt_client.publish(topic, b"", qos=0, retain=True)
                     
-                    for item in status_list:
-                        if isinstance(item, dict) and 'code' in item:
-                            code = item['code']
-                            value = item['value']
-                            # Scaling Logic
-                            if code == 'cur_voltage':
-                                value = value / 10.0
-                            elif code == 'cur_power':
-                                value = value / 10.0
-                            elif code == 'add_ele':
-                                value = value / 1000.0
-                            
-                            device_data[code] = value
-                            
-                            # Publish to MQTT: tuya/{device_id}/{code}/state
-                            topic = f"{MQTT_TOPIC_PREFIX}/{device_id}/{code}/state"
-                            
-                            # Format value
-                            if isinstance(value, bool):
-                                payload = "ON" if value else "OFF"
-                            else:
-                                payload = str(value)
-                            
-                            mqtt_client.publish(topic, payload, retain=True)
-                            
-                            # Thai Translation Map
-                            THAI_LABELS = {
-                                "cur_current": "กระแสไฟฟ้า (mA)",
-                                "cur_power": "กำลังไฟฟ้า (W)",
-                                "cur_voltage": "แรงดันไฟฟ้า (V)",
-                                "add_ele": "พลังงานสะสม (kWh)", # Unit updated to kWh
-                                "switch": "สถานะสวิตช์",
-                                "switch_1": "สวิตช์ 1",
-                                "switch_2": "สวิตช์ 2",
-                                "countdown_1": "นับถอยหลัง 1",
-                                "countdown_2": "นับถอยหลัง 2",
-                                "relay_status": "สถานะ Relay",
-                                "test_bit": "โหมดทดสอบ",
-                                "voltage_coe": "ค่าแก้แรงดัน",
-                                "electric_coe": "ค่าแก้พลังงาน",
-                                "power_coe": "ค่าแก้กำลังไฟ",
-                                "electricity_coe": "ค่าแก้หน่วยไฟฟ้า",
-                                "fault": "ความผิดปกติ",
-                                "switch_backlight": "ไฟพื้นหลัง",
-                                "switch_inching": "Inch Mode"
-                            }
-                            
-                            label = THAI_LABELS.get(code, code)
-                            # Indented output for readability
-                            print(f"   🔹 {label} ({code}) : {payload}")
+                    # Format value (bools are singletons, so identity checks suffice)
+                    if value is True:
+                        payload = "ON"
+                    elif value is False:
+                        payload = "OFF"
+                    else:
+                        payload = str(value)
                     
-                    # Publish full device data
-                    full_topic = f"{MQTT_TOPIC_PREFIX}/{device_id}/telemetry"
-                    full_payload = json.dumps({
-                        "name": device_name,
-                        "id": device_id,
-                        "data": device_data,
-                        "timestamp": int(time.time()),
-                        "api_t": data.get('t', 0) # Cloud Timestamp
-                    })
-                    mqtt_client.publish(full_topic, full_payload, retain=True)
+                    if refresh or last_state.get(code) != payload:
+                        last_state[code] = payload
+                        mqtt_client.publish(topic, payload, qos=0, retain=code not in UNRETAINED_CODES)
                     
-                    # Publish discovery message (for Device Manager)
-                    discovery_topic = f"discovery/device/{device_id}/config"
-                    discovery_payload = json.dumps({
-                        "name": device_name,
-                        "unique_id": device_id,
-                        "state_topic": full_topic,
-                        "command_topic": f"{MQTT_TOPIC_PREFIX}/{device_id}/set",  # Base command topic
-                        "device": {
-                            "identifiers": [device_id],
-                            "name": device_name,
-                            "manufacturer": "Tuya"
-                        }
-                    })
-                    mqtt_client.publish(discovery_topic, discovery_payload, retain=True)
-
-                    # ===== MongoDB Logging =====
-                    if collection is not None:
-                        should_log = True
-                        
-                        # Logic: Check Din Rail Status FIRST for global state
-                        if device_name == "Din Rail Wi-Fi Switch with metering":
-                            switch_status = device_data.get('switch')
-                            if switch_status is not None:
-                                din_rail_is_on = switch_status # Update Global State
-                                if din_rail_is_on is False:
-                                    print("Din Rail is OFF -> Logging Disabled for this cycle.")
-
-                        # Condition 1: If IT IS the Din Rail and it's OFF -> Skip
-                        if device_name == "Din Rail Wi-Fi Switch with metering":
-                            if not din_rail_is_on:
-                                should_log = False
-                                print(f"DB Log Skipped (Main Power OFF)")
-                        
-                        # Condition 2: If IT IS the 2CH Switch -> Depend on Din Rail
-                        elif device_name == "WiFi Smart 2CH Touch Switch":
-                            if not din_rail_is_on:
-                                should_log = False
-                                print(f"DB Log Skipped (Dependent on Main Power)")
-
-                        if should_log:
-                            doc = {
-                                "timestamp": datetime.now(),
-                                "device_id": device_id,
-                                "device_name": device_name,
-                                "status": device_data, # Use the SCALED data
-                                "source": "tuya_cloud_mqtt_bridge"
-                            }
-                            try:
-                                result = collection.insert_one(doc)
-                                print(f"   Saved to MongoDB: {result.inserted_id}")
-                            except Exception as e:
-                                print(f"    Failed to save to DB: {e}")
+                    if debug:
+                        label = THAI_LABELS.get(code, code)
+                        # Indented output for readability
+                        lines.append(f"   🔹 {label} ({code}) : {payload}")
+            
+            # Publish full device data: {name, id, data, timestamp, api_t (Cloud Timestamp)}
+            full_payload = b'%b%b,"timestamp":%d,"api_t":%b}' % (
+                ctx["telemetry_head"],
+                orjson.dumps(device_data),
+                int(cycle_ts),
+                orjson.dumps(data.get('t', 0)),
+            )
+            mqtt_client.publish(ctx["telemetry_topic"], full_payload, qos=0, retain=True)
+
+            # ===== MongoDB Logging =====
+            if collection is not None:
+                should_log = True
+                
+                with din_rail_lock:
+                    # Logic: Check Din Rail Status FIRST for global state
+                    if device_name == DIN_RAIL_NAME:
+                        switch_status = device_data.get('switch')
+                        if switch_status is not None:
+                            din_rail_is_on = switch_status # Update Global State
+                            if din_rail_is_on is False:
+                                lines.append("Din Rail is OFF -> Logging Disabled for this cycle.")
+                    main_power_on = din_rail_is_on
+
+                # Condition 1: If IT IS the Din Rail and it's OFF -> Skip
+                if device_name == DIN_RAIL_NAME:
+                    if not main_power_on:
+                        should_log = False
+                        lines.append(f"DB Log Skipped (Main Power OFF)")
+                
+                # Condition 2: If IT IS the 2CH Switch -> Depend on Din Rail
+                elif device_name == TOUCH_SWITCH_NAME:
+                    if not main_power_on:
+                        should_log = False
+                        lines.append(f"DB Log Skipped (Dependent on Main Power)")
+
+                if should_log:
+                    doc = {
+                        "timestamp": cycle_dt,
+                        "device_id": device_id,
+                        "device_name": device_name,
+                        "status": device_data, # Use the SCALED data
+                        "source": "tuya_cloud_mqtt_bridge"
+                    }
+    except Exception as e:
+        log.error("Error polling %s: %s", device_name, e)
+    finally:
+        if lines:
+            log.info("\n".join(lines))
+    return doc
+
+# Din Rail is polled first so dependent devices see its updated state
+din_rail_devices = [ctx for ctx in device_ctx if ctx["name"] == DIN_RAIL_NAME]
+other_devices = [ctx for ctx in device_ctx if ctx["name"] != DIN_RAIL_NAME]
+
+# Tuya Cloud calls are network-bound, so poll devices concurrently
+executor = ThreadPoolExecutor(max_workers=max(1, min(32, len(device_ctx))))
+
+# ===== Main Loop: Fetch ALL Devices → Publish to MQTT =====
+print("\n Starting data polling loop...")
+print("Press Ctrl+C to stop\n")
+
+try:
+    # Fixed-rate schedule: cycles start every POLL_INTERVAL regardless of work time
+    next_tick = time.monotonic()
+    while True:
+        try:
+            # One timestamp per cycle, shared by every device
+            cycle_ts = time.time()
+            poll = partial(poll_device, cycle_ts=cycle_ts, cycle_dt=datetime.fromtimestamp(cycle_ts))
+            
+            statuses = fetch_batch_status() if use_batch_status else None
+            if statuses is None:
+                statuses = {}
+            
+            # Devices missing from the batch fall back to cloud.getstatus()
+            docs_to_insert = [poll(ctx, statuses.get(ctx["id"])) for ctx in din_rail_devices]
+            docs_to_insert.extend(executor.map(
+                poll, other_devices, [statuses.get(ctx["id"]) for ctx in other_devices]
+            ))
+            docs_to_insert = [doc for doc in docs_to_insert if doc is not None]
+            
+            # ===== MongoDB Logging (one batch per cycle) =====
+            if collection is not None and docs_to_insert:
+                try:
+                    collection.insert_many(docs_to_insert, ordered=False)
+                    log.info("   Saved %d docs to MongoDB", len(docs_to_insert))
+                except Exception as e:
+                    log.error("    Failed to save to DB: %s", e)
             
-            print(f"\nPoll completed at {time.strftime('%H:%M:%S')} (Heartbeat)")
-            print("-" * 60)
+            log.info("\nPoll completed at %s (Heartbeat)\n%s", time.strftime('%H:%M:%S'), "-" * 60)
         
         except Exception as e:
-            print(f"Error in polling loop: {e}")
+            log.error("Error in polling loop: %s", e)
         
-        # Wait before next poll
-        time.sleep(POLL_INTERVAL)
+        # Wait until the next scheduled poll
+        next_tick += POLL_INTERVAL
+        sleep_for = next_tick - time.monotonic()
+        if sleep_for > 0:
+            time.sleep(sleep_for)
+        else:
+            log.warning("Poll overran by %.2fs", -sleep_for)
+            next_tick = time.monotonic()
 
 except KeyboardInterrupt:
     print("\n\nStopping...")
+    executor.shutdown(wait=False)
     mqtt_client.disconnect()
     print("Disconnected from MQTT")
     print("Goodbye!")